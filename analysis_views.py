@@ -0,0 +1,88 @@
+# analysis_views.py
+"""
+Precomputed series and aggregates for the analysis panel.
+
+Everything here is built once per analysis (or per change of the Them label),
+so switching the trend metric in the UI is a dict lookup.
+"""
+from typing import Dict, Optional
+
+import pandas as pd
+
+from message_scoring import SCORE_METRICS
+
+
+# Overall cards use the mean of the last few turns
+TAIL_N = 3
+RISK_WEIGHTS = {"escalation_risk": 0.45, "misunderstanding_risk": 0.30, "toxicity": 0.25}
+
+EWMA_SPAN = 3
+
+
+def overall_metrics(df: pd.DataFrame, tail_n: int = TAIL_N) -> Dict[str, int]:
+   """
+   Tail means of every metric plus the weighted overall_risk (all 0–100 ints).
+   """
+   tail = df.tail(tail_n)
+   out = {m: int(round(tail[m].mean())) for m in SCORE_METRICS}
+   out["overall_risk"] = overall_risk(out)
+   return out
+
+
+def overall_risk(metrics: Dict[str, float]) -> int:
+   return int(round(sum(w * metrics[m] for m, w in RISK_WEIGHTS.items())))
+
+
+def _own_messages(vals: pd.Series, mask, span: Optional[int]) -> pd.Series:
+   # Smooth over the speaker's own messages only, then forward-fill across the other's turns
+   own = vals.where(mask).dropna()
+   if span:
+       own = own.ewm(span=span, adjust=False).mean()
+   return own.reindex(vals.index).ffill()
+
+
+def speaker_series(df: pd.DataFrame, them_name: str, span: Optional[int] = None) -> Dict[str, pd.DataFrame]:
+   """
+   Per metric: wide frame indexed by turn with Overall / Me / <them_name> columns.
+   Speaker columns are forward-filled so each line spans the whole chart.
+   With span, every column is an EWMA over that series' own messages.
+   """
+   turns = df["turn"].to_numpy()
+   is_me = (df["speaker"] == "Me").to_numpy()
+   out = {}
+   for m in SCORE_METRICS:
+       vals = df[m].astype(float).reset_index(drop=True)
+       overall = vals.ewm(span=span, adjust=False).mean() if span else vals
+       wide = pd.DataFrame(
+           {
+               "Overall": overall.to_numpy(),
+               "Me": _own_messages(vals, is_me, span).to_numpy(),
+               them_name: _own_messages(vals, ~is_me, span).to_numpy(),
+           },
+           index=pd.Index(turns, name="turn"),
+       )
+       out[m] = wide
+   return out
+
+
+def to_long(wide: pd.DataFrame) -> pd.DataFrame:
+   """
+   Long (turn, series, value) form for Altair.
+   """
+   return (
+       wide.reset_index()
+       .melt(id_vars=["turn"], var_name="series", value_name="value")
+       .dropna()
+       .reset_index(drop=True)
+   )
+
+
+def build_analysis_views(df: pd.DataFrame, them_name: str, span: int = EWMA_SPAN) -> Dict[str, object]:
+   """
+   {"overall": {...}, "trend": {metric: long_df}, "ewma": {metric: long_df}}
+   """
+   return {
+       "overall": overall_metrics(df),
+       "trend": {m: to_long(w) for m, w in speaker_series(df, them_name).items()},
+       "ewma": {m: to_long(w) for m, w in speaker_series(df, them_name, span).items()},
+   }
@@ -1,22 +1,29 @@
 import os
-import re
 import json
 import html
 import pandas as pd
 import requests
 import streamlit as st
 import altair as alt
-from transformers import pipeline
 
 
-from goemotions_scoring import (
-   GOEMOTIONS_TAXONOMY,
-   scores_from_emotion_probs,
-   top_emotions,
+from model_registry import (
+   DEFAULT_EMOTION_MODEL,
+   DEFAULT_TOXICITY_MODEL,
+   build_pipeline,
+   emotion_probs_from_output,
+   toxicity_from_output,
 )
 
+from analysis_views import EWMA_SPAN, build_analysis_views
 
-from llm_ontology import analyze_conversation_llm
+from text_normalize import DedupTracker, lexical_key, model_key
+
+from message_scoring import SCORE_METRICS, combine_scores, lexical_scores as compute_lexical_scores
+
+from session_store import SessionFormatError, list_sessions, load_session, save_session, session_path
+
+from llm_ontology import LLM_STATS, analyze_conversation_llm, llm_failure_rates
 
 
 
@@ -53,10 +60,20 @@ if "analysis_df" not in st.session_state:
    st.session_state.analysis_df = None
 if "show_analysis" not in st.session_state:
    st.session_state.show_analysis = False
+if "analysis_views" not in st.session_state:
+   st.session_state.analysis_views = None
 if "trend_metric" not in st.session_state:
    st.session_state.trend_metric = "escalation_risk"
 
 
+# score records restored from a saved session (anything with .get(text) -> record)
+if "score_cache" not in st.session_state:
+   st.session_state.score_cache = {}
+
+# opt-in: share model scores across texts with the same normalized key
+if "normalize_model_keys" not in st.session_state:
+   st.session_state.normalize_model_keys = os.getenv("DIFFUSER_NORMALIZE_MODEL_KEYS", "") == "1"
+
 # suggestion persistence
 if "suggestion" not in st.session_state:
    st.session_state.suggestion = None
@@ -77,6 +94,23 @@ with st.sidebar:
    them = st.text_input("Their name (Them)", value=st.session_state.them_name).strip()
    st.session_state.them_name = them if them else "Them"
    st.caption("This only changes labels + prompts. It doesn’t affect scoring models.")
+   st.checkbox(
+       "Share model scores across near-identical texts",
+       key="normalize_model_keys",
+       help="Case, whitespace, curly quotes and trailing periods are ignored for model scores.",
+   )
+
+   if not IS_CLOUD and LLM_STATS["suggestions"]:
+       with st.expander("LLM output health"):
+           rates = llm_failure_rates()
+           st.caption(
+               f"Suggestions: {LLM_STATS['suggestions']} • Requests: {LLM_STATS['requests']}\n\n"
+               f"Schema failures: {rates['schema_failure_rate']:.0%} • "
+               f"Repaired: {rates['repair_rate']:.0%} • "
+               f"Repair failures: {rates['repair_failure_rate']:.0%} • "
+               f"HTTP errors: {rates['http_failure_rate']:.0%} • "
+               f"Gave up: {rates['final_failure_rate']:.0%}"
+           )
 
 
 
@@ -91,6 +125,7 @@ with colA:
    if st.button("Reset conversation"):
        st.session_state.messages = []
        st.session_state.next_speaker = "Me"
+       st.session_state.score_cache = {}
        st.session_state.analysis_df = None
        st.session_state.show_analysis = False
        st.session_state.suggestion = None
@@ -123,191 +158,74 @@ st.divider()
 # Models (cached)
 # ---------------------------
 @st.cache_resource
-def load_goemotions_pipeline():
-   return pipeline(
-       "text-classification",
-       model="SamLowe/roberta-base-go_emotions",
-       top_k=None,
-       truncation=True,
-       device=-1,  # CPU
-   )
+def load_goemotions_pipeline(name: str = DEFAULT_EMOTION_MODEL):
+   return build_pipeline("emotion", name)
 
 
 @st.cache_resource
-def load_toxicity_pipeline():
-   return pipeline(
-       "text-classification",
-       model="unitary/toxic-bert",
-       truncation=True,
-       device=-1,
-   )
+def load_toxicity_pipeline(name: str = DEFAULT_TOXICITY_MODEL):
+   return build_pipeline("toxicity", name)
 
 
 @st.cache_data(show_spinner=False)
 def goemotions_probs(text: str) -> dict:
    clf = load_goemotions_pipeline()
-   out = clf(text)
-   items = out[0] if isinstance(out, list) else out
-   probs = {}
-   for d in items:
-       label = d.get("label")
-       score = d.get("score", 0.0)
-       if isinstance(label, str):
-           probs[label] = float(score)
-   return probs
+   return emotion_probs_from_output(clf(text))
 
 
 @st.cache_data(show_spinner=False)
 def toxicity_score(text: str) -> int:
    tox = load_toxicity_pipeline()
-   out = tox(text)
-   if isinstance(out, list) and out and isinstance(out[0], dict):
-       score = float(out[0].get("score", 0.0))
-       label = str(out[0].get("label", "")).lower()
-       # toxic-bert is binary; normalize so higher always means "more toxic"
-       if "non" in label and "toxic" in label:
-           score = 1.0 - score
-       return int(round(100 * max(0.0, min(1.0, score))))
-   return 0
+   return toxicity_from_output(tox(text))
 
 
 
 
 # ---------------------------
-# Misunderstanding (A) + Clarification attempt (still useful)
+# Score + “why” explanation (cached per text)
 # ---------------------------
-MIND_READING = [
-   "you meant", "you were trying", "you were tryna", "you did that because",
-   "you just wanted", "you only", "you think", "you don't even", "you dont even"
-]
-ASSUMPTION_STARTERS = ["so you're", "so youre", "so you are", "clearly", "obviously", "i guess"]
-OVERGENERAL = ["always", "never", "every time", "as usual"]
-CONTEXT_REFERENCES = ["earlier", "before", "last time", "again", "like always", "as usual", "the other day"]
-VAGUE_WORDS = ["that", "this", "it", "stuff", "things", "whatever"]
-
-
-CLARIFYING_PHRASES = [
-   "help me understand", "can you help me understand", "what do you mean",
-   "can we talk", "can we talk about it", "can we talk about this",
-   "i'm trying to understand", "im trying to understand",
-   "i might be misunderstanding", "maybe i'm misunderstanding",
-   "to be clear", "can you clarify", "clarify", "what happened"
-]
-
-
-INSULT_WORDS = ["crazy", "psycho", "insane", "delusional", "pathetic", "stupid", "dumb"]
-DISMISSIVE = ["whatever", "k", "fine", "stop", "idc", "i don't care", "i dont care"]
-
-
-
-
-def misunderstanding_risk_A(text: str) -> int:
-   t = text.lower().strip()
-   score = 0
-   score += 18 * sum(1 for p in MIND_READING if p in t)
-   score += 12 * sum(1 for p in ASSUMPTION_STARTERS if p in t)
-   score += 10 * sum(1 for p in OVERGENERAL if p in t)
-   score += 8 * sum(1 for p in CONTEXT_REFERENCES if p in t)
-
-
-   tokens = re.findall(r"[a-zA-Z']+", t)
-   vague_hits = sum(1 for w in VAGUE_WORDS if re.search(rf"\b{re.escape(w)}\b", t))
-   if len(tokens) <= 10 and vague_hits >= 2:
-       score += 18
-   elif vague_hits >= 5:
-       score += 12
-
-
-   you_count = len(re.findall(r"\byou\b", t))
-   if you_count >= 3 and len(tokens) <= 14:
-       score += 8
+@st.cache_resource
+def get_dedup_tracker() -> DedupTracker:
+   # Process-wide, so key sharing and savings span all sessions
+   return DedupTracker()
 
 
-   return max(0, min(100, score))
+@st.cache_data(show_spinner=False)
+def lexical_scores(key: str) -> dict:
+   """
+   Rule-based features, keyed on lexical_key(text).
+   """
+   return compute_lexical_scores(key)
 
 
+@st.cache_data(show_spinner=False)
+def score_and_explain(text: str, normalize_models: bool = False) -> dict:
+   """
+   Model scores use the exact text unless normalize_models is on, in which case
+   texts sharing a model_key reuse the first variant's (cached) inference.
+   """
+   dedup = get_dedup_tracker()
+   lex_key = lexical_key(text)
+   dedup.canonical("lexical", text, lex_key)
+   # Always tracked, so the savings are visible before opting in
+   model_text = dedup.canonical("model", text, model_key(text))
+   if not normalize_models:
+       model_text = text
 
 
-def clarification_attempt(text: str) -> int:
-   t = text.lower().strip()
-   score = 0
-   score += 25 * sum(1 for p in CLARIFYING_PHRASES if p in t)
-   score += min(10, 3 * t.count("?"))
-   return max(0, min(100, score))
+   probs = goemotions_probs(model_text)
+   tox = toxicity_score(model_text)
+   return combine_scores(probs, tox, lexical_scores(lex_key))
 
 
 
 
-def escalation_override(text: str) -> int:
+def scores_for(text: str) -> dict:
    """
-   Small deterministic bump for obvious escalation words (helps correct cases like 'you're being crazy').
+   Score records restored from a saved session take priority, so reopening needs no inference.
    """
-   t = text.lower().strip()
-   bump = 0
-   for w in INSULT_WORDS:
-       if re.search(rf"\b{re.escape(w)}\b", t):
-           bump = max(bump, 50)
-   for p in DISMISSIVE:
-       if re.search(rf"\b{re.escape(p)}\b", t):
-           bump = max(bump, 25)
-   return bump
-
-
-
-
-# ---------------------------
-# Score + “why” explanation (cached per text)
-# ---------------------------
-@st.cache_data(show_spinner=False)
-def score_and_explain(text: str) -> dict:
-   probs = goemotions_probs(text)
-   base = scores_from_emotion_probs(probs)  # escalation_risk + empathy_level
-   tops = top_emotions(probs, k=3)
-
-
-   tox = toxicity_score(text)
-   mis = misunderstanding_risk_A(text)
-   clar = clarification_attempt(text)
-
-
-   esc = max(int(base.get("escalation_risk", 0)), tox)
-   esc = min(100, esc + escalation_override(text))
-
-
-   emp = int(base.get("empathy_level", 0))
-
-
-   t = text.lower()
-   reasons = []
-   if any(w in t for w in OVERGENERAL):
-       reasons.append("Overgeneralizing (always/never/as usual)")
-   if any(p in t for p in MIND_READING):
-       reasons.append("Mind-reading / assuming intent")
-   if any(p in t for p in ASSUMPTION_STARTERS):
-       reasons.append("Assumption starter (clearly/obviously/so you’re...)")
-   if any(re.search(rf"\b{re.escape(w)}\b", t) for w in INSULT_WORDS):
-       reasons.append("Name-calling / labeling")
-   if any(re.search(rf"\b{re.escape(p)}\b", t) for p in DISMISSIVE):
-       reasons.append("Dismissive / shutdown phrase")
-   if "!" in text:
-       reasons.append("Exclamation intensity")
-   if text.count("?") >= 2:
-       reasons.append("Multiple question marks")
-   if clar >= 40:
-       reasons.append("Repair language present (clarifying / de-escalating)")
-   if not reasons:
-       reasons.append("No strong red flags detected (mostly neutral wording)")
-
-
-   return {
-       "escalation_risk": int(esc),
-       "toxicity": int(tox),
-       "misunderstanding_risk": int(mis),
-       "clarification_attempt": int(clar),
-       "empathy_level": int(emp),
-       "top_emotions": tops,     # list[(label, prob)]
-       "reasons": reasons[:4],   # top reasons only
-   }
+   rec = st.session_state.score_cache.get(text)
+   return rec if rec is not None else score_and_explain(text, st.session_state.normalize_model_keys)
 
 
 
@@ -338,16 +256,71 @@ def heat_style(score_0_100: int) -> str:
 
 
 
+# ---------------------------
+# Sidebar: save / load sessions (Arrow IPC)
+# ---------------------------
+with st.sidebar:
+   st.subheader("Sessions")
+   session_name = st.text_input("Session name", value="conversation")
+   if st.button("Save session", disabled=not st.session_state.messages):
+       path = session_path(session_name)
+       save_session(
+           path,
+           st.session_state.messages,
+           [scores_for(m["text"]) for m in st.session_state.messages],
+           them_name=st.session_state.them_name,
+           next_speaker=st.session_state.next_speaker,
+       )
+       st.success(f"Saved {path}")
+
+   saved = list_sessions()
+   if saved:
+       to_load = st.selectbox("Saved sessions", saved)
+       if st.button("Load session"):
+           try:
+               msgs, recs, info = load_session(session_path(to_load))
+           except SessionFormatError as e:
+               st.error(f"Can’t load session: {e}")
+           else:
+               st.session_state.messages = msgs
+               st.session_state.score_cache = recs  # lazy, memory-mapped; .get(text) like a dict
+               st.session_state.them_name = info["them_name"]
+               st.session_state.next_speaker = info["next_speaker"]
+               st.session_state.analysis_df = None
+               st.session_state.show_analysis = False
+               st.session_state.suggestion = None
+               st.session_state.suggestion_error = None
+               st.rerun()
+
+
+
+
+# ---------------------------
+# Sidebar: normalization savings
+# ---------------------------
+with st.sidebar:
+   dedup_stats = get_dedup_tracker().stats()
+   if dedup_stats:
+       with st.expander("Text normalization savings"):
+           for component, d in dedup_stats.items():
+               # Model keys are tracked even with sharing off; then nothing is actually saved
+               verb = "saved" if component == "lexical" or st.session_state.normalize_model_keys else "would save"
+               st.caption(
+                   f"{component}: {d['unique_raw']} texts → {d['unique_keys']} keys "
+                   f"({verb} {d['saved']} calls, {d['saved_rate']:.0%})"
+               )
+
+
+
+
 # ---------------------------
 # Heatmap overlay ALWAYS ON (no toggle)
 # ---------------------------
 st.session_state.setdefault("heatmap_metric", "escalation_risk")
 st.session_state.heatmap_metric = st.selectbox(
    "Heatmap metric",
-   ["escalation_risk", "toxicity", "misunderstanding_risk", "clarification_attempt", "empathy_level"],
-   index=["escalation_risk", "toxicity", "misunderstanding_risk", "clarification_attempt", "empathy_level"].index(
-       st.session_state.heatmap_metric
-   ),
+   SCORE_METRICS,
+   index=SCORE_METRICS.index(st.session_state.heatmap_metric),
 )
 
 
@@ -418,7 +391,7 @@ for m in st.session_state.messages:
    safe_text = html.escape(raw_text)
 
 
-   s = score_and_explain(raw_text)
+   s = scores_for(raw_text)
    tip_raw = tooltip_text_for_message(s)
    tip_attr = html.escape(tip_raw, quote=True).replace("\n", "&#10;")
 
@@ -485,6 +458,37 @@ else:
 # ---------------------------
 # Analysis + 3-line trend chart
 # ---------------------------
+def get_analysis_views(df: pd.DataFrame, them_name: str) -> dict:
+   """
+   Series, aggregates and chart specs are built once per analysis / Them label,
+   then reused across reruns (e.g. when only the trend metric changes).
+   """
+   views = st.session_state.analysis_views
+   if views is None or views["them_name"] != them_name:
+       views = build_analysis_views(df, them_name)
+       views["them_name"] = them_name
+       views["charts"] = {}
+       st.session_state.analysis_views = views
+   return views
+
+
+def trend_chart(views: dict, metric: str, smooth: bool) -> alt.Chart:
+   key = (metric, smooth)
+   if key not in views["charts"]:
+       data = views["ewma" if smooth else "trend"][metric]
+       views["charts"][key] = (
+           alt.Chart(data)
+           .mark_line()
+           .encode(
+               x=alt.X("turn:Q", title="Turn"),
+               y=alt.Y("value:Q", title=metric, scale=alt.Scale(domain=[0, 100])),
+               color=alt.Color("series:N", title=""),
+               tooltip=["turn:Q", "series:N", alt.Tooltip("value:Q", format=".0f")],
+           )
+       )
+   return views["charts"][key]
+
+
 st.divider()
 st.subheader("Analysis")
 
@@ -500,7 +504,7 @@ if st.button("Analyze conversation"):
        rows = []
        with st.spinner("Scoring…"):
            for idx, m in enumerate(msgs, start=1):
-               s = score_and_explain(m["text"])
+               s = scores_for(m["text"])
                tops = s["top_emotions"]
                rows.append({
                    "turn": idx,
@@ -516,6 +520,7 @@ if st.button("Analyze conversation"):
 
 
        st.session_state.analysis_df = pd.DataFrame(rows)
+       st.session_state.analysis_views = None
        st.session_state.show_analysis = True
 
        # Clear old suggestion if we are waiting on Them
@@ -540,65 +545,29 @@ if st.button("Analyze conversation"):
 
 if st.session_state.show_analysis and st.session_state.analysis_df is not None:
    df = st.session_state.analysis_df
-
-
-   tail = df.tail(3)
-   overall_esc = int(round(tail["escalation_risk"].mean()))
-   overall_tox = int(round(tail["toxicity"].mean()))
-   overall_mis = int(round(tail["misunderstanding_risk"].mean()))
-   overall_clar = int(round(tail["clarification_attempt"].mean()))
-   overall_emp = int(round(tail["empathy_level"].mean()))
-   overall_risk = int(round(0.45 * overall_esc + 0.30 * overall_mis + 0.25 * overall_tox))
+   views = get_analysis_views(df, st.session_state.them_name)
+   overall = views["overall"]
 
 
    c1, c2, c3, c4, c5, c6 = st.columns(6)
-   c1.metric("Escalation", overall_esc)
-   c2.metric("Toxicity", overall_tox)
-   c3.metric("Misunderstanding (A)", overall_mis)
-   c4.metric("Clarification", overall_clar)
-   c5.metric("Empathy", overall_emp)
-   c6.metric("Overall Risk", overall_risk)
+   c1.metric("Escalation", overall["escalation_risk"])
+   c2.metric("Toxicity", overall["toxicity"])
+   c3.metric("Misunderstanding (A)", overall["misunderstanding_risk"])
+   c4.metric("Clarification", overall["clarification_attempt"])
+   c5.metric("Empathy", overall["empathy_level"])
+   c6.metric("Overall Risk", overall["overall_risk"])
 
 
    metric_choice = st.selectbox(
        "Trend metric",
-       ["escalation_risk", "toxicity", "misunderstanding_risk", "clarification_attempt", "empathy_level"],
-       index=["escalation_risk", "toxicity", "misunderstanding_risk", "clarification_attempt", "empathy_level"].index(
-           st.session_state.trend_metric
-       ),
+       SCORE_METRICS,
+       index=SCORE_METRICS.index(st.session_state.trend_metric),
        key="trend_metric",
    )
+   smooth = st.checkbox(f"EWMA-smoothed (span {EWMA_SPAN})", key="trend_smooth")
 
 
-   chart_df = df[["turn", "speaker", metric_choice]].copy()
-   chart_df["Overall"] = chart_df[metric_choice]
-   chart_df["Me"] = chart_df[metric_choice].where(chart_df["speaker"] == "Me")
-   chart_df[st.session_state.them_name] = chart_df[metric_choice].where(chart_df["speaker"] == st.session_state.them_name)
-
-
-   chart_df["Me"] = chart_df["Me"].ffill()
-   chart_df[st.session_state.them_name] = chart_df[st.session_state.them_name].ffill()
-
-
-   melted = chart_df.melt(
-       id_vars=["turn"],
-       value_vars=["Overall", "Me", st.session_state.them_name],
-       var_name="series",
-       value_name="value",
-   ).dropna()
-
-
-   line = (
-       alt.Chart(melted)
-       .mark_line()
-       .encode(
-           x=alt.X("turn:Q", title="Turn"),
-           y=alt.Y("value:Q", title=metric_choice, scale=alt.Scale(domain=[0, 100])),
-           color=alt.Color("series:N", title=""),
-           tooltip=["turn:Q", "series:N", "value:Q"],
-       )
-   )
-   st.altair_chart(line, use_container_width=True)
+   st.altair_chart(trend_chart(views, metric_choice, smooth), use_container_width=True)
 
 
    st.write("Per-message breakdown:")
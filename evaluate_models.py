@@ -0,0 +1,264 @@
+# evaluate_models.py
+"""
+Accuracy-vs-latency harness for the swappable emotion / toxicity scorers.
+
+Runs every registered candidate (or a chosen subset) over the labelled GoEmotions
+sample and reports latency, throughput, memory, and agreement with the current
+escalation / empathy scores.
+
+   python evaluate_models.py
+   python evaluate_models.py --emotion distilbert-go_emotions --toxicity toxic-bert --limit 200
+   python evaluate_models.py --out outputs/model_eval.csv
+"""
+import argparse
+import ast
+import multiprocessing as mp
+import resource
+import statistics
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import pandas as pd
+
+from goemotions_scoring import GOEMOTIONS_TAXONOMY, scores_from_emotion_probs, top_emotions
+from model_registry import (
+   DEFAULT_EMOTION_MODEL,
+   DEFAULT_TOXICITY_MODEL,
+   EMOTION_MODELS,
+   TOXICITY_MODELS,
+   build_pipeline,
+   emotion_probs_from_output,
+   get_spec,
+   toxicity_from_output,
+)
+
+
+DEFAULT_CORPUS = "goemotions_sample_scored.csv"
+
+
+def peak_rss_mb() -> float:
+   """
+   Peak resident set size of this process in MB (ru_maxrss is KB on Linux, bytes on macOS).
+   """
+   peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+   return peak / 1e6 if sys.platform == "darwin" else peak / 1e3
+
+
+def load_corpus(path: str, limit: int = 0) -> pd.DataFrame:
+   df = pd.read_csv(path)
+   df["labels"] = df["labels"].apply(ast.literal_eval)
+   if limit:
+       df = df.head(limit)
+   return df.reset_index(drop=True)
+
+
+def pearson(a: List[float], b: List[float]) -> float:
+   if len(a) < 2 or statistics.pstdev(a) == 0 or statistics.pstdev(b) == 0:
+       return float("nan")
+   return statistics.correlation(a, b)
+
+
+def mae(a: List[float], b: List[float]) -> float:
+   return sum(abs(x - y) for x, y in zip(a, b)) / max(1, len(a))
+
+
+def time_model(run_one: Callable, run_batch: Callable, texts: List[str], batch_size: int) -> Dict[str, float]:
+   """
+   Per-message latency (one call per text) and batched throughput.
+   Returns the per-text outputs from the single-message pass.
+   """
+   run_one(texts[0])  # warm-up
+
+   outputs = []
+   lat_ms = []
+   for t in texts:
+       t0 = time.perf_counter()
+       outputs.append(run_one(t))
+       lat_ms.append(1000 * (time.perf_counter() - t0))
+
+   t0 = time.perf_counter()
+   run_batch(texts, batch_size)
+   batch_s = time.perf_counter() - t0
+
+   lat_sorted = sorted(lat_ms)
+   return {
+       "outputs": outputs,
+       "latency_ms_p50": statistics.median(lat_ms),
+       "latency_ms_p95": lat_sorted[int(0.95 * (len(lat_sorted) - 1))],
+       "throughput_msg_s": len(texts) / batch_s if batch_s > 0 else float("nan"),
+   }
+
+
+def _import_backend(kind: str, name: str) -> None:
+   """
+   Import the inference libraries up front so load time / RSS below reflect the
+   model itself, not the one-off cost of importing torch / onnxruntime.
+   """
+   import transformers  # noqa: F401
+
+   if get_spec(kind, name).backend == "onnx":
+       import optimum.onnxruntime  # noqa: F401
+
+
+def load_measured(kind: str, name: str):
+   """
+   Build the pipeline and return it with its load metrics. Each candidate runs in a
+   fresh process, so the RSS figures are not skewed by earlier candidates.
+   """
+   spec = get_spec(kind, name)
+   rss0 = peak_rss_mb()
+   t0 = time.perf_counter()
+   pipe = build_pipeline(kind, name)
+   load_s = time.perf_counter() - t0
+   return pipe, {
+       "kind": kind,
+       "model": name,
+       "model_id": spec.model_id,
+       "load_s": load_s,
+       "baseline_rss_mb": rss0,
+       "load_peak_rss_mb": peak_rss_mb() - rss0,
+   }
+
+
+def evaluate_emotion(name: str, df: pd.DataFrame, batch_size: int) -> Dict[str, float]:
+   texts = df["text"].tolist()
+   clf, out = load_measured("emotion", name)
+
+   res = time_model(
+       lambda t: emotion_probs_from_output(clf(t)),
+       lambda ts, bs: clf(ts, batch_size=bs),
+       texts,
+       batch_size,
+   )
+   probs = res.pop("outputs")
+   scores = [scores_from_emotion_probs(p) for p in probs]
+
+   # Top-1 emotion hits one of the gold GoEmotions labels
+   hits = 0
+   for p, gold in zip(probs, df["labels"]):
+       top = top_emotions(p, k=1)[0][0]
+       hits += int(GOEMOTIONS_TAXONOMY.index(top) in gold)
+
+   esc = [s["escalation_risk"] for s in scores]
+   emp = [s["empathy_level"] for s in scores]
+   out.update({
+       "top1_label_acc": hits / len(texts),
+       "escalation_mae": mae(esc, df["escalation_risk"].tolist()),
+       "escalation_r": pearson(esc, df["escalation_risk"].tolist()),
+       "empathy_mae": mae(emp, df["empathy_level"].tolist()),
+       "empathy_r": pearson(emp, df["empathy_level"].tolist()),
+   })
+   out.update(res)
+   return out
+
+
+def evaluate_toxicity(name: str, df: pd.DataFrame, batch_size: int, reference: List[int]) -> Dict[str, float]:
+   texts = df["text"].tolist()
+   tox, out = load_measured("toxicity", name)
+
+   res = time_model(
+       lambda t: toxicity_from_output(tox(t)),
+       lambda ts, bs: tox(ts, batch_size=bs),
+       texts,
+       batch_size,
+   )
+   scores = res.pop("outputs")
+
+   out.update({
+       # Agreement with the current default toxicity model
+       "toxicity_mae_vs_default": mae(scores, reference) if reference else float("nan"),
+       "toxic_flag_agreement": (
+           sum((a >= 50) == (b >= 50) for a, b in zip(scores, reference)) / len(scores) if reference else float("nan")
+       ),
+       # Toxicity feeds max(emotion escalation, toxicity) in the app
+       "escalation_r": pearson(scores, df["escalation_risk"].tolist()),
+   })
+   out.update(res)
+   if name == DEFAULT_TOXICITY_MODEL:
+       out["_scores"] = scores
+   return out
+
+
+def _candidate_child(conn, kind: str, name: str, corpus: str, limit: int, batch_size: int, reference: List[int]) -> None:
+   try:
+       _import_backend(kind, name)
+       df = load_corpus(corpus, limit)
+       if kind == "emotion":
+           row = evaluate_emotion(name, df, batch_size)
+       else:
+           row = evaluate_toxicity(name, df, batch_size, reference)
+   except Exception as e:
+       row = {"kind": kind, "model": name, "error": f"{type(e).__name__}: {e}"}
+   row["peak_rss_mb"] = peak_rss_mb()
+   conn.send(row)
+   conn.close()
+
+
+def run_candidate(
+   kind: str, name: str, corpus: str, limit: int, batch_size: int, reference: Optional[List[int]] = None
+) -> Dict[str, Any]:
+   """
+   Evaluate one candidate in a fresh (spawned) process so ru_maxrss is that model's
+   own peak, and a failed download / load / OOM doesn't discard the other results.
+   """
+   print(f"[{kind}] {name} …")
+   ctx = mp.get_context("spawn")
+   recv, send = ctx.Pipe(duplex=False)
+   proc = ctx.Process(
+       target=_candidate_child, args=(send, kind, name, corpus, limit, batch_size, reference or [])
+   )
+   proc.start()
+   send.close()
+   try:
+       row = recv.recv()
+   except EOFError:
+       row = {"kind": kind, "model": name, "error": "candidate process died"}
+   proc.join()
+   if "error" in row and proc.exitcode:
+       row["error"] += f" (exit code {proc.exitcode})"
+   if "error" in row:
+       print(f"[{kind}] {name} failed: {row['error']}")
+   return row
+
+
+def main() -> None:
+   ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+   ap.add_argument("--corpus", default=DEFAULT_CORPUS)
+   ap.add_argument("--limit", type=int, default=0, help="Only use the first N rows (0 = all)")
+   ap.add_argument("--batch-size", type=int, default=16)
+   ap.add_argument("--emotion", nargs="*", default=list(EMOTION_MODELS), help="Emotion model names")
+   ap.add_argument("--toxicity", nargs="*", default=list(TOXICITY_MODELS), help="Toxicity model names")
+   ap.add_argument("--out", default="", help="Write the report to this CSV path")
+   args = ap.parse_args()
+
+   df = load_corpus(args.corpus, args.limit)
+   print(f"Corpus: {args.corpus} ({len(df)} messages)")
+
+   rows = []
+   for name in args.emotion:
+       rows.append(run_candidate("emotion", name, args.corpus, args.limit, args.batch_size))
+
+   # Score the default toxicity model first so others are compared against it
+   tox_names = sorted(args.toxicity, key=lambda n: n != DEFAULT_TOXICITY_MODEL)
+   reference: List[int] = []
+   for name in tox_names:
+       row = run_candidate("toxicity", name, args.corpus, args.limit, args.batch_size, reference)
+       reference = row.pop("_scores", reference)
+       rows.append(row)
+
+   report = pd.DataFrame(rows)
+   for kind, defaults in (("emotion", DEFAULT_EMOTION_MODEL), ("toxicity", DEFAULT_TOXICITY_MODEL)):
+       part = report[report["kind"] == kind].dropna(axis=1, how="all")
+       if part.empty:
+           continue
+       print(f"\n== {kind} (current default: {defaults}) ==")
+       print(part.drop(columns=["kind"]).to_string(index=False, float_format=lambda v: f"{v:.3f}"))
+
+   if args.out:
+       report.to_csv(args.out, index=False)
+       print(f"\nSaved {args.out}")
+
+
+if __name__ == "__main__":
+   main()
@@ -0,0 +1,405 @@
+# live_scoring.py
+"""
+Streaming live scorer for chat platform traffic.
+
+Reads JSONL message events keyed by conversation ID:
+
+   {"conversation_id": "c42", "speaker": "Me", "text": "whatever.", "ts": 1718000000.0}
+
+and writes JSONL to stdout: one "score" event per message (with rolling
+per-conversation aggregates), "alert" events when a threshold is crossed,
+and "evicted" events when an idle conversation is dropped.
+
+   cat feed.jsonl | python live_scoring.py
+   python live_scoring.py --tail /var/log/chat/feed.jsonl
+   python live_scoring.py --unix /tmp/diffuser.sock
+   python live_scoring.py --tcp 127.0.0.1:8765
+"""
+import argparse
+import json
+import os
+import queue
+import socketserver
+import stat
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Set
+
+from analysis_views import EWMA_SPAN, TAIL_N, overall_risk
+from message_scoring import SCORE_METRICS, MessageScorer
+
+
+ScoreFn = Callable[[str], Dict[str, Any]]
+
+
+@dataclass
+class Thresholds:
+   escalation: int = 70      # rolling tail mean of escalation_risk
+   overall_risk: int = 60    # rolling weighted overall risk
+   toxicity: int = 80        # single message
+   empathy_floor: int = -1   # rolling empathy at or below this (disabled by default)
+
+
+@dataclass
+class ConversationState:
+   """
+   Bounded per-conversation state: the last `window` metric rows plus running EWMAs.
+   """
+   window: Deque[Dict[str, Any]]
+   last_seen: float
+   turns: int = 0
+   ewma: Dict[str, float] = field(default_factory=dict)
+   active_alerts: Set[str] = field(default_factory=set)
+
+   def update(self, speaker: str, record: Dict[str, Any], now: float) -> Dict[str, Any]:
+       self.turns += 1
+       self.last_seen = now
+       row = {m: int(record[m]) for m in SCORE_METRICS}
+       row["speaker"] = speaker
+       self.window.append(row)
+
+       alpha = 2.0 / (EWMA_SPAN + 1)
+       for m in SCORE_METRICS:
+           prev = self.ewma.get(m)
+           self.ewma[m] = float(row[m]) if prev is None else alpha * row[m] + (1 - alpha) * prev
+       return self.rolling()
+
+   def rolling(self) -> Dict[str, Any]:
+       """
+       Same aggregates as the analysis panel: tail(TAIL_N) means and overall_risk.
+       """
+       tail = list(self.window)[-TAIL_N:]
+       out: Dict[str, Any] = {m: int(round(sum(r[m] for r in tail) / len(tail))) for m in SCORE_METRICS}
+       out["overall_risk"] = overall_risk(out)
+       out["ewma"] = {m: round(v, 1) for m, v in self.ewma.items()}
+       out["turns"] = self.turns
+       return out
+
+
+class LiveScorer:
+   """
+   Keeps rolling state for many conversations with a hard cap on how many are held
+   (least recently active evicted first) and a time-to-live for idle ones.
+   """
+
+   def __init__(
+       self,
+       score_fn: ScoreFn,
+       window: int = 10,
+       max_conversations: int = 10_000,
+       idle_ttl_s: float = 1800.0,
+       thresholds: Optional[Thresholds] = None,
+       include_probs: bool = False,
+   ):
+       self.score_fn = score_fn
+       self.window = max(window, TAIL_N)
+       self.max_conversations = max_conversations
+       self.idle_ttl_s = idle_ttl_s
+       self.thresholds = thresholds or Thresholds()
+       self.include_probs = include_probs
+       self.conversations: "OrderedDict[str, ConversationState]" = OrderedDict()
+       self.processed = 0
+
+   def _state(self, conv_id: str, now: float) -> ConversationState:
+       state = self.conversations.get(conv_id)
+       if state is None:
+           state = ConversationState(window=deque(maxlen=self.window), last_seen=now)
+           self.conversations[conv_id] = state
+       else:
+           self.conversations.move_to_end(conv_id)
+       return state
+
+   def _alerts(self, conv_id: str, state: ConversationState, record: Dict[str, Any], rolling: Dict[str, Any]) -> List[Dict[str, Any]]:
+       th = self.thresholds
+       checks = {
+           "escalation": (rolling["escalation_risk"], rolling["escalation_risk"] >= th.escalation),
+           "overall_risk": (rolling["overall_risk"], rolling["overall_risk"] >= th.overall_risk),
+           "toxicity": (record["toxicity"], record["toxicity"] >= th.toxicity),
+           "low_empathy": (rolling["empathy_level"], rolling["empathy_level"] <= th.empathy_floor),
+       }
+       alerts = []
+       for name, (value, firing) in checks.items():
+           # Edge-triggered: alert once when crossing, re-arm after it clears
+           if firing and name not in state.active_alerts:
+               state.active_alerts.add(name)
+               alerts.append({"type": "alert", "conversation_id": conv_id, "alert": name, "value": value, "turn": state.turns})
+           elif not firing:
+               state.active_alerts.discard(name)
+       return alerts
+
+   def process(self, event: Dict[str, Any], now: Optional[float] = None) -> List[Dict[str, Any]]:
+       now = time.time() if now is None else now
+       conv_id = str(event["conversation_id"])
+       text = str(event["text"]).strip()
+       speaker = str(event.get("speaker", ""))
+
+       record = self.score_fn(text)
+       state = self._state(conv_id, now)
+       rolling = state.update(speaker, record, now)
+       self.processed += 1
+
+       scores = {m: record[m] for m in SCORE_METRICS}
+       scores["top_emotions"] = record["top_emotions"]
+       scores["reasons"] = record["reasons"]
+       if self.include_probs:
+           scores["emotion_probs"] = record["emotion_probs"]
+
+       out = [{
+           "type": "score",
+           "conversation_id": conv_id,
+           "turn": state.turns,
+           "speaker": speaker,
+           "ts": event.get("ts", now),
+           "scores": scores,
+           "rolling": rolling,
+       }]
+       out.extend(self._alerts(conv_id, state, record, rolling))
+       out.extend(self._evict_over_capacity())
+       return out
+
+   def _evicted(self, conv_id: str, state: ConversationState, reason: str) -> Dict[str, Any]:
+       return {"type": "evicted", "conversation_id": conv_id, "reason": reason, "rolling": state.rolling()}
+
+   def _evict_over_capacity(self) -> List[Dict[str, Any]]:
+       out = []
+       while len(self.conversations) > self.max_conversations:
+           conv_id, state = self.conversations.popitem(last=False)
+           out.append(self._evicted(conv_id, state, "capacity"))
+       return out
+
+   def evict_idle(self, now: Optional[float] = None) -> List[Dict[str, Any]]:
+       now = time.time() if now is None else now
+       out = []
+       # OrderedDict is kept in last-activity order, so stop at the first fresh one
+       while self.conversations:
+           conv_id, state = next(iter(self.conversations.items()))
+           if now - state.last_seen < self.idle_ttl_s:
+               break
+           self.conversations.popitem(last=False)
+           out.append(self._evicted(conv_id, state, "idle"))
+       return out
+
+
+# ---------------------------
+# Feed sources (each pushes raw lines into a queue; None = end of feed)
+# ---------------------------
+def _read_stream(stream: Iterable[str], q: "queue.Queue[Optional[str]]") -> None:
+   for line in stream:
+       q.put(line)
+   q.put(None)
+
+
+def start_stdin(q: "queue.Queue[Optional[str]]") -> None:
+   threading.Thread(target=_read_stream, args=(sys.stdin, q), daemon=True).start()
+
+
+def _tail(f, path: str, q: "queue.Queue[Optional[str]]", poll_s: float) -> None:
+   buf = ""
+   while True:
+       chunk = f.readline()
+       if chunk:
+           buf += chunk
+           if buf.endswith("\n"):
+               q.put(buf)
+               buf = ""
+           continue
+       # At EOF: check for rotation (path now points at a new file) or in-place truncation
+       try:
+           st = os.stat(path)
+       except FileNotFoundError:
+           st = None  # mid-rotation; keep the old handle until the new file appears
+       if st is not None and st.st_ino != os.fstat(f.fileno()).st_ino:
+           f.close()
+           f = open(path, "r", encoding="utf-8")
+           buf = ""
+           continue
+       if st is not None and st.st_size < f.tell():
+           f.seek(0)
+       time.sleep(poll_s)
+
+
+def start_tail(path: str, q: "queue.Queue[Optional[str]]", from_start: bool = False, poll_s: float = 0.25) -> None:
+   # Open here so a missing / unreadable file fails loudly instead of inside the thread
+   f = open(path, "r", encoding="utf-8")
+   if not from_start:
+       f.seek(0, os.SEEK_END)
+   threading.Thread(target=_tail, args=(f, path, q, poll_s), daemon=True).start()
+
+
+def _remove_stale_socket(path: str) -> None:
+   """
+   Clear a socket left by a previous run; refuse to touch anything else at path.
+   """
+   try:
+       mode = os.lstat(path).st_mode
+   except FileNotFoundError:
+       return
+   if not stat.S_ISSOCK(mode):
+       raise FileExistsError(f"--unix path exists and is not a socket: {path}")
+   os.unlink(path)
+
+
+def check_source(args: argparse.Namespace) -> None:
+   """
+   Validate source paths up front (raises OSError), e.g. before loading models.
+   """
+   if args.tail and not os.path.isfile(args.tail):
+       raise FileNotFoundError(f"--tail file not found: {args.tail}")
+   if args.unix and os.path.lexists(args.unix) and not stat.S_ISSOCK(os.lstat(args.unix).st_mode):
+       raise FileExistsError(f"--unix path exists and is not a socket: {args.unix}")
+
+
+def start_socket(address: str, q: "queue.Queue[Optional[str]]", unix: bool) -> socketserver.BaseServer:
+   class Handler(socketserver.StreamRequestHandler):
+       def handle(self):
+           for raw in self.rfile:
+               q.put(raw.decode("utf-8", errors="replace"))
+
+   if unix:
+       _remove_stale_socket(address)
+       server: socketserver.BaseServer = socketserver.ThreadingUnixStreamServer(address, Handler)
+   else:
+       host, port = address.rsplit(":", 1)
+       server = socketserver.ThreadingTCPServer((host, int(port)), Handler)
+   server.daemon_threads = True
+   threading.Thread(target=server.serve_forever, daemon=True).start()
+   return server
+
+
+def parse_event(line: str) -> Optional[Dict[str, Any]]:
+   line = line.strip()
+   if not line:
+       return None
+   try:
+       event = json.loads(line)
+   except ValueError:
+       print(f"skipping invalid JSON: {line[:200]}", file=sys.stderr)
+       return None
+   if not isinstance(event, dict) or "conversation_id" not in event or "text" not in event:
+       print(f"skipping event without conversation_id/text: {line[:200]}", file=sys.stderr)
+       return None
+   return event
+
+
+def error_event(event: Dict[str, Any], exc: Exception) -> Dict[str, Any]:
+   return {
+       "type": "error",
+       "conversation_id": str(event.get("conversation_id")),
+       "error": f"{type(exc).__name__}: {exc}",
+   }
+
+
+def emit(obj: Dict[str, Any]) -> None:
+   sys.stdout.write(json.dumps(obj, ensure_ascii=False) + "\n")
+   sys.stdout.flush()
+
+
+def dedup_event(scorer: Any) -> Dict[str, Any]:
+   """
+   Normalization savings on this feed. With normalize_models off, the "model"
+   figures are what sharing would have saved, not what it saved.
+   """
+   return {"type": "dedup_stats", "normalize_models": scorer.normalize_models, "components": scorer.dedup.stats()}
+
+
+def run(
+   live: LiveScorer,
+   q: "queue.Queue[Optional[str]]",
+   sweep_s: float = 5.0,
+   stats_fn: Optional[Callable[[], Dict[str, Any]]] = None,
+   stats_interval_s: float = 0.0,
+) -> None:
+   """
+   stats_fn (e.g. dedup_event) is emitted every stats_interval_s seconds, if set,
+   and once at the end of the feed.
+   """
+   last_sweep = last_stats = time.time()
+   while True:
+       try:
+           line = q.get(timeout=sweep_s)
+       except queue.Empty:
+           line = ""
+       if line is None:
+           break
+       event = parse_event(line) if line else None
+       if event is not None:
+           try:
+               outs = live.process(event)
+           except Exception as e:
+               # One bad event must not end the stream (and every conversation's state)
+               outs = [error_event(event, e)]
+           for out in outs:
+               emit(out)
+       if time.time() - last_sweep >= sweep_s:
+           for out in live.evict_idle():
+               emit(out)
+           last_sweep = time.time()
+       if stats_fn and stats_interval_s and time.time() - last_stats >= stats_interval_s:
+           emit(stats_fn())
+           last_stats = time.time()
+   if stats_fn:
+       emit(stats_fn())
+
+
+def add_live_args(ap: argparse.ArgumentParser) -> None:
+   src = ap.add_mutually_exclusive_group()
+   src.add_argument("--tail", metavar="PATH", help="Follow a JSONL file")
+   src.add_argument("--unix", metavar="PATH", help="Listen on a Unix domain socket")
+   src.add_argument("--tcp", metavar="HOST:PORT", help="Listen on a local TCP socket")
+   ap.add_argument("--from-start", action="store_true", help="With --tail, read existing lines first")
+   ap.add_argument("--window", type=int, default=10, help="Messages kept per conversation")
+   ap.add_argument("--max-conversations", type=int, default=10_000)
+   ap.add_argument("--idle-ttl", type=float, default=1800.0, help="Seconds before an idle conversation is evicted")
+   ap.add_argument("--esc-threshold", type=int, default=Thresholds.escalation)
+   ap.add_argument("--risk-threshold", type=int, default=Thresholds.overall_risk)
+   ap.add_argument("--tox-threshold", type=int, default=Thresholds.toxicity)
+   ap.add_argument("--empathy-floor", type=int, default=Thresholds.empathy_floor)
+   ap.add_argument("--normalize", action="store_true", help="Share model scores across normalized text keys")
+   ap.add_argument("--probs", action="store_true", help="Include the 28 emotion probabilities in score events")
+   ap.add_argument("--stats-interval", type=float, default=0.0, help="Emit stats every N seconds (0 = only at end)")
+
+
+def live_kwargs(args: argparse.Namespace) -> Dict[str, Any]:
+   return {
+       "window": args.window,
+       "max_conversations": args.max_conversations,
+       "idle_ttl_s": args.idle_ttl,
+       "thresholds": Thresholds(args.esc_threshold, args.risk_threshold, args.tox_threshold, args.empathy_floor),
+       "include_probs": args.probs,
+   }
+
+
+def start_source(args: argparse.Namespace) -> "queue.Queue[Optional[str]]":
+   q: "queue.Queue[Optional[str]]" = queue.Queue(maxsize=10_000)
+   if args.tail:
+       start_tail(args.tail, q, from_start=args.from_start)
+   elif args.unix:
+       start_socket(args.unix, q, unix=True)
+   elif args.tcp:
+       start_socket(args.tcp, q, unix=False)
+   else:
+       start_stdin(q)
+   return q
+
+
+def main() -> None:
+   ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+   add_live_args(ap)
+   args = ap.parse_args()
+
+   try:
+       check_source(args)
+       lines = start_source(args)
+   except OSError as e:
+       ap.error(str(e))
+
+   scorer = MessageScorer(normalize_models=args.normalize)
+   live = LiveScorer(scorer.score, **live_kwargs(args))
+   run(live, lines, stats_fn=lambda: dedup_event(scorer), stats_interval_s=args.stats_interval)
+
+
+if __name__ == "__main__":
+   main()
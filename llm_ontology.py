@@ -1,80 +1,211 @@
 # llm_ontology.py
 import json
 import requests
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional, Tuple
+
+
+OLLAMA_CHAT_URL = "http://localhost:11434/v1/chat/completions"
+
+
+# JSON schema for the Me-only suggestion object.
+# Sent to Ollama as a structured-output constraint and re-checked on receipt.
+SUGGESTION_SCHEMA: Dict[str, Any] = {
+   "type": "object",
+   "properties": {
+       "likely_emotions_them": {
+           "type": "array",
+           "items": {"type": "string"},
+           "minItems": 1,
+           "maxItems": 3,
+       },
+       "self_validation_line": {"type": "string"},
+       "clarifying_question": {"type": "string"},
+       "next_message": {"type": "string"},
+       "why_this_works": {"type": "string"},
+   },
+   "required": [
+       "likely_emotions_them",
+       "self_validation_line",
+       "clarifying_question",
+       "next_message",
+       "why_this_works",
+   ],
+   "additionalProperties": False,
+}
+
+# Fields that must be non-empty for a suggestion to be usable.
+# clarifying_question may legitimately be blank.
+NON_EMPTY_FIELDS = ["likely_emotions_them", "self_validation_line", "next_message"]
+
+
+# Process-wide counters so failure rates can be inspected (e.g. in the sidebar).
+LLM_STATS: Dict[str, int] = {
+   "requests": 0,            # every HTTP generation, including repairs
+   "suggestions": 0,         # analyze_conversation_llm calls
+   "parse_failures": 0,      # first attempt was not a JSON object
+   "schema_failures": 0,     # first attempt parsed, but fields missing / wrong type
+   "repaired_suggestions": 0,  # suggestions that needed at least one repair
+   "repairs": 0,             # targeted field re-requests
+   "repair_failures": 0,     # repair requests that still left invalid fields
+   "http_failures": 0,       # non-200 responses, timeouts, connection errors
+   "failed_suggestions": 0,  # no usable suggestion (HTTP failure or repair budget spent)
+}
+
+
+def llm_failure_rates() -> Dict[str, float]:
+   """
+   Failure rates (0–1), derived from LLM_STATS. First-attempt, repair and final
+   rates are per suggestion; repair_failure_rate is per repair request.
+   """
+   n = max(1, LLM_STATS["suggestions"])
+   return {
+       "schema_failure_rate": (LLM_STATS["parse_failures"] + LLM_STATS["schema_failures"]) / n,
+       "repair_rate": LLM_STATS["repaired_suggestions"] / n,
+       "repair_failure_rate": LLM_STATS["repair_failures"] / max(1, LLM_STATS["repairs"]),
+       "http_failure_rate": LLM_STATS["http_failures"] / max(1, LLM_STATS["requests"]),
+       "final_failure_rate": LLM_STATS["failed_suggestions"] / n,
+       "requests_per_suggestion": LLM_STATS["requests"] / n,
+   }
 
 
 def safe_json_from_text(text: str) -> Dict[str, Any]:
    """
-   Parse JSON even if the model adds extra text.
-   Strategy: find first '{' and last '}'.
+   Strict parse: with a schema-constrained response the content must be a JSON object.
+   No slicing between braces — a bad payload is reported, then repaired.
    """
-   text = text.strip()
-   try:
-       return json.loads(text)
-   except Exception:
-       pass
+   obj = json.loads(text.strip())
+   if not isinstance(obj, dict):
+       raise ValueError("Model did not return a JSON object.")
+   return obj
 
 
-   l = text.find("{")
-   r = text.rfind("}")
-   if l != -1 and r != -1 and r > l:
-       return json.loads(text[l:r+1])
-   raise ValueError("Model did not return valid JSON.")
+def _field_ok(name: str, value: Any) -> bool:
+   spec = SUGGESTION_SCHEMA["properties"][name]
+   if spec["type"] == "string":
+       if not isinstance(value, str):
+           return False
+       return bool(value.strip()) or name not in NON_EMPTY_FIELDS
+   if spec["type"] == "array":
+       if not isinstance(value, list) or not all(isinstance(v, str) and v.strip() for v in value):
+           return False
+       return spec["minItems"] <= len(value) <= spec["maxItems"]
+   return False
 
 
-def ollama_chat_json(model: str, system: str, user: str, timeout_s: int = 120) -> Dict[str, Any]:
+def validate_suggestion(obj: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
    """
-   Uses Ollama OpenAI-compatible endpoint and forces JSON output using response_format.
+   Split a model payload into (valid fields, names of missing/invalid fields).
+   Unknown keys are dropped.
    """
-   r = requests.post(
-       "http://localhost:11434/v1/chat/completions",
-       json={
-           "model": model,
-           "messages": [
-               {"role": "system", "content": system},
-               {"role": "user", "content": user},
-           ],
-           "temperature": 0.2,
-           # IMPORTANT: force JSON
-           "response_format": {"type": "json_object"},
-       },
-       timeout=timeout_s,
-   )
+   good: Dict[str, Any] = {}
+   bad: List[str] = []
+   for name in SUGGESTION_SCHEMA["required"]:
+       if name in obj and _field_ok(name, obj[name]):
+           value = obj[name]
+           good[name] = value.strip() if isinstance(value, str) else [v.strip() for v in value]
+       else:
+           bad.append(name)
+   return good, bad
+
+
+def _sub_schema(fields: List[str]) -> Dict[str, Any]:
+   return {
+       "type": "object",
+       "properties": {f: SUGGESTION_SCHEMA["properties"][f] for f in fields},
+       "required": list(fields),
+       "additionalProperties": False,
+   }
+
+
+def ollama_chat_json(
+   model: str,
+   system: str,
+   user: str,
+   timeout_s: int = 120,
+   schema: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+   """
+   Uses Ollama OpenAI-compatible endpoint. With a schema the output is constrained
+   via response_format=json_schema; otherwise it falls back to plain json_object.
+   """
+   if schema is not None:
+       response_format = {
+           "type": "json_schema",
+           "json_schema": {"name": "suggestion", "schema": schema, "strict": True},
+       }
+   else:
+       response_format = {"type": "json_object"}
+
+   LLM_STATS["requests"] += 1
+   try:
+       r = requests.post(
+           OLLAMA_CHAT_URL,
+           json={
+               "model": model,
+               "messages": [
+                   {"role": "system", "content": system},
+                   {"role": "user", "content": user},
+               ],
+               "temperature": 0.2,
+               "response_format": response_format,
+           },
+           timeout=timeout_s,
+       )
+   except requests.RequestException as e:
+       LLM_STATS["http_failures"] += 1
+       raise RuntimeError(f"Ollama request failed: {e}") from e
    if r.status_code != 200:
+       LLM_STATS["http_failures"] += 1
        raise RuntimeError(f"Ollama HTTP {r.status_code}: {r.text[:800]}")
 
 
    data = r.json()
    content = data["choices"][0]["message"]["content"]
-   return safe_json_from_text(content)
+   try:
+       return safe_json_from_text(content)
+   except ValueError:
+       # json.JSONDecodeError is a ValueError too; callers treat {} as unparseable
+       return {}
+
+
+SYSTEM_PROMPT = (
+   "You generate the NEXT message for the speaker named 'Me'. "
+   "Return ONLY a JSON object. Do not include markdown, backticks, or extra text.\n\n"
+   "Hard rules:\n"
+   "- Write as ME (first-person).\n"
+   "- Do NOT write as Them.\n"
+   "- Validate both people's feelings and perspectives.\n"
+   "- Keep next_message short like real texting (1–3 short lines).\n"
+   "- Do NOT insult, threaten, or escalate.\n"
+   "- If an insult was already said by ME, ALWAYS apologize and de-escalate in the next message.\n"
+   "- If they told Me to stop texting / leave them alone, the best response is to respect the boundary.\n"
+   "- Replace always and never with specific instances and prompt ME to fill in those instances.\n"
+)
 
 
 def analyze_conversation_llm(
    conversation_text: str,
    model: str = "llama3.1:8b",
-   timeout_s: int = 120
+   timeout_s: int = 120,
+   max_repairs: int = 1,
 ) -> Dict[str, Any]:
    """
    Returns a Me-only suggestion JSON.
-   """
-
 
-   system = (
-       "You generate the NEXT message for the speaker named 'Me'. "
-       "Return ONLY a JSON object. Do not include markdown, backticks, or extra text.\n\n"
-       "Hard rules:\n"
-       "- Write as ME (first-person).\n"
-       "- Do NOT write as Them.\n"
-       "- Validate both people's feelings and perspectives.\n"
-       "- Keep next_message short like real texting (1–3 short lines).\n"
-       "- Do NOT insult, threaten, or escalate.\n"
-       "- If an insult was already said by ME, ALWAYS apologize and de-escalate in the next message.\n"
-       "- If they told Me to stop texting / leave them alone, the best response is to respect the boundary.\n"
-       "- Replace always and never with specific instances and prompt ME to fill in those instances.\n"
-   )
+   The first call is schema-constrained. If a required (NON_EMPTY_FIELDS) field is
+   still missing or invalid, only the missing fields are re-requested (up to
+   max_repairs times), keeping the valid ones from earlier attempts. Missing
+   optional fields alone never trigger a repair; they default to "".
+   """
+   LLM_STATS["suggestions"] += 1
+   try:
+       return _suggest(conversation_text, model, timeout_s, max_repairs)
+   except Exception:
+       LLM_STATS["failed_suggestions"] += 1
+       raise
 
 
+def _suggest(conversation_text: str, model: str, timeout_s: int, max_repairs: int) -> Dict[str, Any]:
    user = f"""
 Return a JSON object with EXACT keys:
 - likely_emotions_them (array of 1–3 strings)
@@ -89,14 +220,40 @@ Conversation:
 """.strip()
 
 
-   out = ollama_chat_json(model=model, system=system, user=user, timeout_s=timeout_s)
+   raw = ollama_chat_json(model=model, system=SYSTEM_PROMPT, user=user, timeout_s=timeout_s, schema=SUGGESTION_SCHEMA)
+   out, missing = validate_suggestion(raw)
+   if not raw:
+       LLM_STATS["parse_failures"] += 1
+   elif missing:
+       LLM_STATS["schema_failures"] += 1
+
+   for attempt in range(max_repairs):
+       if not any(k in NON_EMPTY_FIELDS for k in missing):
+           break
+       if attempt == 0:
+           LLM_STATS["repaired_suggestions"] += 1
+       LLM_STATS["repairs"] += 1
+       repair_user = (
+           "Some fields of your previous answer were missing or invalid.\n"
+           f"Return a JSON object with ONLY these keys: {', '.join(missing)}\n\n"
+           f"Already decided (keep consistent, do not repeat): {json.dumps(out, ensure_ascii=False)}\n\n"
+           f"Conversation:\n{conversation_text}"
+       )
+       raw = ollama_chat_json(
+           model=model, system=SYSTEM_PROMPT, user=repair_user, timeout_s=timeout_s, schema=_sub_schema(missing)
+       )
+       fixed, _ = validate_suggestion(raw)
+       out.update({k: v for k, v in fixed.items() if k in missing})
+       missing = [k for k in missing if k not in out]
+       if any(k in NON_EMPTY_FIELDS for k in missing):
+           LLM_STATS["repair_failures"] += 1
 
+   required_missing = [k for k in missing if k in NON_EMPTY_FIELDS]
+   if required_missing:
+       raise ValueError(f"Model output missing required fields after repair: {', '.join(required_missing)}")
 
-   # Ensure keys exist
-   out.setdefault("likely_emotions_them", [])
-   out.setdefault("self_validation_line", "")
+
+   # Optional fields are defaulted rather than repaired
    out.setdefault("clarifying_question", "")
-   out.setdefault("next_message", "")
    out.setdefault("why_this_works", "")
    return out
-
@@ -0,0 +1,223 @@
+# message_scoring.py
+"""
+Per-message scoring shared by the Streamlit app, the live scorer and the worker pool.
+
+Lexical rules are plain functions; combine_scores() turns model outputs plus
+lexical features into the record shape score_and_explain() returns.
+MessageScorer bundles both models with bounded caches for use outside Streamlit.
+"""
+import re
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from goemotions_scoring import GOEMOTIONS_TAXONOMY, scores_from_emotion_probs, top_emotions
+from model_registry import (
+   DEFAULT_EMOTION_MODEL,
+   DEFAULT_TOXICITY_MODEL,
+   build_pipeline,
+   emotion_probs_from_output,
+   toxicity_from_output,
+)
+from text_normalize import DedupTracker, lexical_key, model_key
+
+
+# The five 0–100 per-message metrics, in display order
+SCORE_METRICS = ["escalation_risk", "toxicity", "misunderstanding_risk", "clarification_attempt", "empathy_level"]
+
+
+
+
+# ---------------------------
+# Misunderstanding (A) + Clarification attempt (still useful)
+# ---------------------------
+MIND_READING = [
+   "you meant", "you were trying", "you were tryna", "you did that because",
+   "you just wanted", "you only", "you think", "you don't even", "you dont even"
+]
+ASSUMPTION_STARTERS = ["so you're", "so youre", "so you are", "clearly", "obviously", "i guess"]
+OVERGENERAL = ["always", "never", "every time", "as usual"]
+CONTEXT_REFERENCES = ["earlier", "before", "last time", "again", "like always", "as usual", "the other day"]
+VAGUE_WORDS = ["that", "this", "it", "stuff", "things", "whatever"]
+
+
+CLARIFYING_PHRASES = [
+   "help me understand", "can you help me understand", "what do you mean",
+   "can we talk", "can we talk about it", "can we talk about this",
+   "i'm trying to understand", "im trying to understand",
+   "i might be misunderstanding", "maybe i'm misunderstanding",
+   "to be clear", "can you clarify", "clarify", "what happened"
+]
+
+
+INSULT_WORDS = ["crazy", "psycho", "insane", "delusional", "pathetic", "stupid", "dumb"]
+DISMISSIVE = ["whatever", "k", "fine", "stop", "idc", "i don't care", "i dont care"]
+
+
+
+
+def misunderstanding_risk_A(text: str) -> int:
+   t = text.lower().strip()
+   score = 0
+   score += 18 * sum(1 for p in MIND_READING if p in t)
+   score += 12 * sum(1 for p in ASSUMPTION_STARTERS if p in t)
+   score += 10 * sum(1 for p in OVERGENERAL if p in t)
+   score += 8 * sum(1 for p in CONTEXT_REFERENCES if p in t)
+
+
+   tokens = re.findall(r"[a-zA-Z']+", t)
+   vague_hits = sum(1 for w in VAGUE_WORDS if re.search(rf"\b{re.escape(w)}\b", t))
+   if len(tokens) <= 10 and vague_hits >= 2:
+       score += 18
+   elif vague_hits >= 5:
+       score += 12
+
+
+   you_count = len(re.findall(r"\byou\b", t))
+   if you_count >= 3 and len(tokens) <= 14:
+       score += 8
+
+
+   return max(0, min(100, score))
+
+
+
+
+def clarification_attempt(text: str) -> int:
+   t = text.lower().strip()
+   score = 0
+   score += 25 * sum(1 for p in CLARIFYING_PHRASES if p in t)
+   score += min(10, 3 * t.count("?"))
+   return max(0, min(100, score))
+
+
+
+
+def escalation_override(text: str) -> int:
+   """
+   Small deterministic bump for obvious escalation words (helps correct cases like 'you're being crazy').
+   """
+   t = text.lower().strip()
+   bump = 0
+   for w in INSULT_WORDS:
+       if re.search(rf"\b{re.escape(w)}\b", t):
+           bump = max(bump, 50)
+   for p in DISMISSIVE:
+       if re.search(rf"\b{re.escape(p)}\b", t):
+           bump = max(bump, 25)
+   return bump
+
+
+
+
+# ---------------------------
+# Score + “why” explanation
+# ---------------------------
+def lexical_scores(key: str) -> dict:
+   """
+   Rule-based features, keyed on lexical_key(text).
+   """
+   mis = misunderstanding_risk_A(key)
+   clar = clarification_attempt(key)
+   override = escalation_override(key)
+
+
+   t = key
+   reasons = []
+   if any(w in t for w in OVERGENERAL):
+       reasons.append("Overgeneralizing (always/never/as usual)")
+   if any(p in t for p in MIND_READING):
+       reasons.append("Mind-reading / assuming intent")
+   if any(p in t for p in ASSUMPTION_STARTERS):
+       reasons.append("Assumption starter (clearly/obviously/so you’re...)")
+   if any(re.search(rf"\b{re.escape(w)}\b", t) for w in INSULT_WORDS):
+       reasons.append("Name-calling / labeling")
+   if any(re.search(rf"\b{re.escape(p)}\b", t) for p in DISMISSIVE):
+       reasons.append("Dismissive / shutdown phrase")
+   if "!" in t:
+       reasons.append("Exclamation intensity")
+   if t.count("?") >= 2:
+       reasons.append("Multiple question marks")
+   if clar >= 40:
+       reasons.append("Repair language present (clarifying / de-escalating)")
+   if not reasons:
+       reasons.append("No strong red flags detected (mostly neutral wording)")
+
+
+   return {"misunderstanding_risk": mis, "clarification_attempt": clar, "override": override, "reasons": reasons}
+
+
+def combine_scores(probs: Dict[str, float], tox: int, lex: Dict[str, Any]) -> Dict[str, Any]:
+   base = scores_from_emotion_probs(probs)  # escalation_risk + empathy_level
+   tops = top_emotions(probs, k=3)
+
+
+   esc = max(int(base.get("escalation_risk", 0)), tox)
+   esc = min(100, esc + lex["override"])
+
+
+   emp = int(base.get("empathy_level", 0))
+
+
+   return {
+       "escalation_risk": int(esc),
+       "toxicity": int(tox),
+       "misunderstanding_risk": int(lex["misunderstanding_risk"]),
+       "clarification_attempt": int(lex["clarification_attempt"]),
+       "empathy_level": int(emp),
+       "top_emotions": tops,     # list[(label, prob)]
+       "emotion_probs": {e: float(probs.get(e, 0.0)) for e in GOEMOTIONS_TAXONOMY},
+       "reasons": lex["reasons"][:4],   # top reasons only
+   }
+
+
+
+
+class _LRU:
+   def __init__(self, maxsize: int):
+       self.maxsize = maxsize
+       self.data: "OrderedDict[str, Any]" = OrderedDict()
+
+   def get_or_compute(self, key: str, fn: Callable[[str], Any]) -> Any:
+       if key in self.data:
+           self.data.move_to_end(key)
+           return self.data[key]
+       value = fn(key)
+       self.data[key] = value
+       if len(self.data) > self.maxsize:
+           self.data.popitem(last=False)
+       return value
+
+
+class MessageScorer:
+   """
+   score_and_explain() without Streamlit: pipelines are passed in (or built from
+   the registry) and results are kept in bounded LRU caches.
+   """
+
+   def __init__(
+       self,
+       emotion_pipeline=None,
+       toxicity_pipeline=None,
+       normalize_models: bool = False,
+       cache_size: int = 4096,
+       dedup: Optional[DedupTracker] = None,
+   ):
+       self.emotion_pipeline = emotion_pipeline or build_pipeline("emotion", DEFAULT_EMOTION_MODEL)
+       self.toxicity_pipeline = toxicity_pipeline or build_pipeline("toxicity", DEFAULT_TOXICITY_MODEL)
+       self.normalize_models = normalize_models
+       self.dedup = dedup or DedupTracker()
+       self._probs = _LRU(cache_size)
+       self._tox = _LRU(cache_size)
+       self._lex = _LRU(cache_size)
+
+   def score(self, text: str) -> Dict[str, Any]:
+       lex_key = lexical_key(text)
+       self.dedup.canonical("lexical", text, lex_key)
+       model_text = self.dedup.canonical("model", text, model_key(text))
+       if not self.normalize_models:
+           model_text = text
+
+       probs = self._probs.get_or_compute(model_text, lambda t: emotion_probs_from_output(self.emotion_pipeline(t)))
+       tox = self._tox.get_or_compute(model_text, lambda t: toxicity_from_output(self.toxicity_pipeline(t)))
+       lex = self._lex.get_or_compute(lex_key, lexical_scores)
+       return combine_scores(probs, tox, lex)
@@ -0,0 +1,117 @@
+# model_registry.py
+import os
+from dataclasses import dataclass
+from typing import Any, Dict
+
+
+@dataclass(frozen=True)
+class ModelSpec:
+   model_id: str
+   kind: str           # "emotion" or "toxicity"
+   note: str = ""
+   backend: str = "torch"  # "torch" (transformers) or "onnx" (optimum + onnxruntime)
+
+
+# Emotion scorers must emit the 28 GoEmotions labels.
+EMOTION_MODELS: Dict[str, ModelSpec] = {
+   "roberta-base-go_emotions": ModelSpec(
+       "SamLowe/roberta-base-go_emotions", "emotion", "Current default (RoBERTa-base, ~125M params)"
+   ),
+   "roberta-base-go_emotions-onnx": ModelSpec(
+       "SamLowe/roberta-base-go_emotions-onnx", "emotion", "Same weights exported to ONNX", backend="onnx"
+   ),
+   "distilbert-go_emotions": ModelSpec(
+       "joeddav/distilbert-base-uncased-go-emotions-student", "emotion", "Distilled student (~66M params)"
+   ),
+}
+
+# Toxicity scorers are binary / multi-label; the top label is used.
+TOXICITY_MODELS: Dict[str, ModelSpec] = {
+   "toxic-bert": ModelSpec("unitary/toxic-bert", "toxicity", "Current default (BERT-base)"),
+   "toxic-roberta": ModelSpec(
+       "s-nlp/roberta_toxicity_classifier", "toxicity", "RoBERTa-base, labels neutral/toxic"
+   ),
+   "toxic-distilbert": ModelSpec(
+       "martin-ha/toxic-comment-model", "toxicity", "DistilBERT (~66M params)"
+   ),
+}
+
+# Override with env vars, e.g. DIFFUSER_EMOTION_MODEL=distilbert-go_emotions
+DEFAULT_EMOTION_MODEL = os.getenv("DIFFUSER_EMOTION_MODEL", "roberta-base-go_emotions")
+DEFAULT_TOXICITY_MODEL = os.getenv("DIFFUSER_TOXICITY_MODEL", "toxic-bert")
+
+
+def get_spec(kind: str, name: str) -> ModelSpec:
+   registry = EMOTION_MODELS if kind == "emotion" else TOXICITY_MODELS
+   if name not in registry:
+       raise KeyError(f"Unknown {kind} model '{name}'. Options: {', '.join(registry)}")
+   return registry[name]
+
+
+def build_pipeline(kind: str, name: str):
+   """
+   Build a CPU transformers pipeline for a registered model.
+   Imported lazily so the registry can be read without torch installed.
+   ONNX specs are loaded through optimum's onnxruntime model class.
+   """
+   from transformers import pipeline
+
+   spec = get_spec(kind, name)
+   model: Any = spec.model_id
+   tokenizer = None
+   if spec.backend == "onnx":
+       try:
+           from optimum.onnxruntime import ORTModelForSequenceClassification
+       except ImportError as e:
+           raise ImportError(
+               f"Model '{name}' needs the ONNX backend: pip install optimum[onnxruntime]"
+           ) from e
+       from transformers import AutoTokenizer
+
+       model = ORTModelForSequenceClassification.from_pretrained(spec.model_id)
+       tokenizer = AutoTokenizer.from_pretrained(spec.model_id)
+
+   if kind == "emotion":
+       return pipeline(
+           "text-classification",
+           model=model,
+           tokenizer=tokenizer,
+           top_k=None,
+           truncation=True,
+           device=-1,  # CPU
+       )
+   return pipeline(
+       "text-classification",
+       model=model,
+       tokenizer=tokenizer,
+       truncation=True,
+       device=-1,
+   )
+
+
+def emotion_probs_from_output(out: Any) -> Dict[str, float]:
+   """
+   Normalize a top_k=None pipeline result for ONE text into {label: prob}.
+   """
+   items = out[0] if isinstance(out, list) and out and isinstance(out[0], list) else out
+   probs = {}
+   for d in items:
+       label = d.get("label")
+       score = d.get("score", 0.0)
+       if isinstance(label, str):
+           probs[label] = float(score)
+   return probs
+
+
+def toxicity_from_output(out: Any) -> int:
+   """
+   Normalize a toxicity pipeline result for ONE text into a 0–100 score.
+   """
+   if isinstance(out, list) and out and isinstance(out[0], dict):
+       score = float(out[0].get("score", 0.0))
+       label = str(out[0].get("label", "")).lower()
+       # binary models; normalize so higher always means "more toxic"
+       if ("non" in label and "toxic" in label) or label == "neutral":
+           score = 1.0 - score
+       return int(round(100 * max(0.0, min(1.0, score))))
+   return 0
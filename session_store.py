@@ -0,0 +1,160 @@
+# session_store.py
+"""
+Save / load conversations with their per-message score records as Arrow IPC files.
+
+One file per session, one row per message:
+turn, speaker, text, the five 0–100 metrics, top_emotions, reasons,
+and the 28 GoEmotions probabilities as prob_<label> columns.
+Session-level fields (them_name, next_speaker) live in the schema metadata,
+so the same files can be read directly by pandas (read_feather) / pyarrow / DuckDB.
+
+Files are written uncompressed so loading is a true memory map: columns are
+views over the file and a score row is only decoded when it is looked up.
+"""
+import json
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+from goemotions_scoring import GOEMOTIONS_TAXONOMY
+from message_scoring import SCORE_METRICS
+
+
+FORMAT_VERSION = "2"
+SESSION_EXT = ".arrow"
+SESSION_DIR = os.getenv("DIFFUSER_SESSION_DIR", "sessions")
+
+PROB_COLUMNS = [f"prob_{e}" for e in GOEMOTIONS_TAXONOMY]
+
+SESSION_SCHEMA = pa.schema(
+   [
+       pa.field("turn", pa.int32()),
+       pa.field("speaker", pa.string()),
+       pa.field("text", pa.string()),
+   ]
+   + [pa.field(m, pa.int16()) for m in SCORE_METRICS]
+   + [
+       pa.field(
+           "top_emotions",
+           pa.list_(pa.struct([pa.field("label", pa.string()), pa.field("prob", pa.float32())])),
+       ),
+       pa.field("reasons", pa.list_(pa.string())),
+   ]
+   + [pa.field(c, pa.float32()) for c in PROB_COLUMNS]
+)
+
+
+class SessionFormatError(ValueError):
+   """
+   The file is not a session written by this version of session_store.
+   """
+
+
+def session_path(name: str, session_dir: str = SESSION_DIR) -> str:
+   safe = "".join(ch if ch.isalnum() or ch in "-_" else "_" for ch in name.strip()) or "session"
+   return os.path.join(session_dir, f"{safe}{SESSION_EXT}")
+
+
+def list_sessions(session_dir: str = SESSION_DIR) -> List[str]:
+   if not os.path.isdir(session_dir):
+       return []
+   return sorted(f[: -len(SESSION_EXT)] for f in os.listdir(session_dir) if f.endswith(SESSION_EXT))
+
+
+def save_session(
+   path: str,
+   messages: List[Dict[str, str]],
+   scores: List[Dict[str, Any]],
+   them_name: str = "Them",
+   next_speaker: str = "Me",
+) -> None:
+   """
+   messages: [{"speaker": "Me"|"Them", "text": ...}]
+   scores:   score_and_explain() records, aligned with messages.
+   """
+   if len(messages) != len(scores):
+       raise ValueError("messages and scores must be the same length.")
+
+   cols: Dict[str, list] = {f.name: [] for f in SESSION_SCHEMA}
+   for idx, (m, s) in enumerate(zip(messages, scores), start=1):
+       cols["turn"].append(idx)
+       cols["speaker"].append(m["speaker"])
+       cols["text"].append(m["text"])
+       for metric in SCORE_METRICS:
+           cols[metric].append(int(s.get(metric, 0)))
+       cols["top_emotions"].append([{"label": e, "prob": float(p)} for e, p in s.get("top_emotions", [])])
+       cols["reasons"].append(list(s.get("reasons", [])))
+       probs = s.get("emotion_probs", {})
+       for e, c in zip(GOEMOTIONS_TAXONOMY, PROB_COLUMNS):
+           cols[c].append(float(probs.get(e, 0.0)))
+
+   meta = {
+       b"diffuser_format": FORMAT_VERSION.encode(),
+       b"diffuser_session": json.dumps({"them_name": them_name, "next_speaker": next_speaker}).encode(),
+   }
+   table = pa.Table.from_pydict(cols, schema=SESSION_SCHEMA.with_metadata(meta))
+
+   os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+   tmp = path + ".tmp"
+   with pa.OSFile(tmp, "wb") as sink, ipc.new_file(sink, table.schema) as writer:
+       writer.write_table(table)
+   os.replace(tmp, path)
+
+
+class SessionScores:
+   """
+   Score records over a memory-mapped session table, decoded per row on first access.
+   Rows have the same shape as score_and_explain(), so no inference is needed.
+   """
+
+   def __init__(self, table: pa.Table):
+       self._table = table
+       self._decoded: Dict[int, Dict[str, Any]] = {}
+       self._row_by_text = {t: i for i, t in enumerate(table.column("text").to_pylist())}
+
+   def __len__(self) -> int:
+       return self._table.num_rows
+
+   def __getitem__(self, i: int) -> Dict[str, Any]:
+       rec = self._decoded.get(i)
+       if rec is None:
+           col = self._table.column
+           rec = {metric: int(col(metric)[i].as_py()) for metric in SCORE_METRICS}
+           rec["top_emotions"] = [(d["label"], float(d["prob"])) for d in col("top_emotions")[i].as_py()]
+           rec["reasons"] = list(col("reasons")[i].as_py())
+           rec["emotion_probs"] = {e: float(col(c)[i].as_py()) for e, c in zip(GOEMOTIONS_TAXONOMY, PROB_COLUMNS)}
+           self._decoded[i] = rec
+       return rec
+
+   def get(self, text: str) -> Optional[Dict[str, Any]]:
+       i = self._row_by_text.get(text)
+       return None if i is None else self[i]
+
+
+def load_session(path: str) -> Tuple[List[Dict[str, str]], SessionScores, Dict[str, str]]:
+   """
+   Memory-mapped read. Only the speaker / text columns are materialized up front.
+   Returns (messages, score records, session info).
+   """
+   try:
+       table = ipc.open_file(pa.memory_map(path, "r")).read_all()
+   except pa.ArrowInvalid as e:
+       raise SessionFormatError(f"{path} is not an Arrow session file: {e}") from e
+   meta = table.schema.metadata or {}
+   version = meta.get(b"diffuser_format", b"").decode() or "unknown"
+   if version != FORMAT_VERSION:
+       raise SessionFormatError(
+           f"{path} uses session format {version}; this version reads format {FORMAT_VERSION}."
+       )
+   info = json.loads(meta.get(b"diffuser_session", b"{}"))
+
+   messages = [
+       {"speaker": sp, "text": t}
+       for sp, t in zip(table.column("speaker").to_pylist(), table.column("text").to_pylist())
+   ]
+
+   info.setdefault("them_name", "Them")
+   info.setdefault("next_speaker", "Them" if messages and messages[-1]["speaker"] == "Me" else "Me")
+   return messages, SessionScores(table), info
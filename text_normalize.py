@@ -0,0 +1,81 @@
+# text_normalize.py
+"""
+Canonical cache keys per scoring component.
+
+- lexical_key: what the rule-based scorers already see (lowercase, collapsed
+ whitespace). Punctuation is kept because "?" and "!" are scored.
+- model_key: opt-in, looser key for the transformer scores. Also folds curly
+ quotes and drops trailing periods / wrapping quotes ("Whatever." == "whatever").
+
+DedupTracker maps each model key to the first raw text seen with it, so the
+model is still fed real text, and counts how much inference the keys save.
+"""
+import re
+import threading
+from typing import Dict, Set
+
+
+_QUOTES = str.maketrans({"‘": "'", "’": "'", "“": '"', "”": '"'})
+_EDGE = re.compile(r"^[\"'\s]+|[\"'.\s]+$")
+
+
+def lexical_key(text: str) -> str:
+   return " ".join(text.lower().split())
+
+
+def model_key(text: str) -> str:
+   key = lexical_key(text.translate(_QUOTES))
+   stripped = _EDGE.sub("", key)
+   return stripped or key
+
+
+class DedupTracker:
+   """
+   Thread-safe (Streamlit serves sessions on threads), bounded by max_keys per component.
+   Once a component is full, new texts pass through unchanged and are not counted.
+   """
+
+   def __init__(self, max_keys: int = 100_000):
+       self.max_keys = max_keys
+       self._lock = threading.Lock()
+       self._rep: Dict[str, Dict[str, str]] = {}
+       self._raw: Dict[str, Set[str]] = {}
+       self._lookups: Dict[str, int] = {}
+
+   def canonical(self, component: str, text: str, key: str) -> str:
+       """
+       Record (text, key) and return the representative raw text for key.
+       """
+       with self._lock:
+           rep = self._rep.setdefault(component, {})
+           raw = self._raw.setdefault(component, set())
+           self._lookups[component] = self._lookups.get(component, 0) + 1
+           if key in rep:
+               if len(raw) < self.max_keys:
+                   raw.add(text)
+               return rep[key]
+           if len(rep) >= self.max_keys:
+               return text
+           rep[key] = text
+           raw.add(text)
+           return text
+
+   def stats(self) -> Dict[str, Dict[str, float]]:
+       """
+       Per component: unique raw texts vs unique keys. Each raw text beyond its
+       key's first is one inference call the normalized key avoids.
+       """
+       out = {}
+       with self._lock:
+           for component, rep in self._rep.items():
+               n_raw = len(self._raw.get(component, ()))
+               n_keys = len(rep)
+               saved = max(0, n_raw - n_keys)
+               out[component] = {
+                   "lookups": self._lookups.get(component, 0),
+                   "unique_raw": n_raw,
+                   "unique_keys": n_keys,
+                   "saved": saved,
+                   "saved_rate": saved / n_raw if n_raw else 0.0,
+               }
+       return out
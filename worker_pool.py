@@ -0,0 +1,293 @@
+# worker_pool.py
+"""
+Multi-process sharded live scoring with shared model memory.
+
+Both pipelines are loaded once in the parent; workers are then forked so the
+weights are shared copy-on-write instead of loaded per process. gc.freeze()
+moves the already-loaded objects out of the collector's reach, so collections
+in the workers don't touch (and copy) those pages.
+
+Events are sharded by crc32(conversation_id) % workers. Each conversation always
+lands on the same worker and its FIFO queue, so per-conversation order is kept.
+
+   python worker_pool.py --workers 4 --tail feed.jsonl
+   cat feed.jsonl | python worker_pool.py --workers 8 --stats-interval 10
+"""
+import argparse
+import gc
+import multiprocessing as mp
+import os
+import queue
+import sys
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, List, Optional
+
+from live_scoring import LiveScorer, add_live_args, check_source, emit, error_event, live_kwargs, parse_event, start_source
+from message_scoring import MessageScorer
+from model_registry import DEFAULT_EMOTION_MODEL, DEFAULT_TOXICITY_MODEL, build_pipeline
+
+
+# Set in the parent before forking; children inherit the loaded pipelines.
+_SHARED: Dict[str, Any] = {}
+
+
+def shard_for(conversation_id: str, n_workers: int) -> int:
+   # crc32 rather than hash(): stable across processes and runs
+   return zlib.crc32(conversation_id.encode("utf-8")) % n_workers
+
+
+def load_shared_models(emotion: str = DEFAULT_EMOTION_MODEL, toxicity: str = DEFAULT_TOXICITY_MODEL) -> None:
+   _SHARED["emotion"] = build_pipeline("emotion", emotion)
+   _SHARED["toxicity"] = build_pipeline("toxicity", toxicity)
+   for pipe in (_SHARED["emotion"], _SHARED["toxicity"]):
+       if hasattr(pipe.model, "eval"):  # ONNX models have no train/eval mode
+           pipe.model.eval()
+   gc.collect()
+   gc.freeze()
+
+
+def _worker(
+   idx: int,
+   inbox: "mp.Queue",
+   outbox: "mp.Queue",
+   live_opts: Dict[str, Any],
+   normalize: bool,
+   threads_per_worker: int,
+   stats_interval_s: float,
+) -> None:
+   import torch
+
+   # One intra-op pool per worker; otherwise N workers x all cores oversubscribe the CPU
+   torch.set_num_threads(threads_per_worker)
+
+   scorer = MessageScorer(_SHARED["emotion"], _SHARED["toxicity"], normalize_models=normalize)
+   live = LiveScorer(scorer.score, **live_opts)
+
+   started = time.perf_counter()
+   busy_s = 0.0
+   errors = 0
+   last_stats = started
+   last_sweep = started
+
+   def stats(final: bool) -> Dict[str, Any]:
+       wall = time.perf_counter() - started
+       return {
+           "type": "worker_stats",
+           "worker": idx,
+           "pid": os.getpid(),
+           "final": final,
+           "messages": live.processed,
+           "errors": errors,
+           "conversations": len(live.conversations),
+           "busy_s": round(busy_s, 3),
+           "msg_per_s": round(live.processed / busy_s, 2) if busy_s else 0.0,
+           "utilization": round(busy_s / wall, 3) if wall else 0.0,
+           # Per shard: each worker has its own key table. With normalize_models
+           # off, the "model" savings are hypothetical.
+           "normalize_models": normalize,
+           "dedup": scorer.dedup.stats(),
+       }
+
+   while True:
+       try:
+           event = inbox.get(timeout=1.0)
+       except queue.Empty:
+           event = {}
+       if event is None:
+           break
+       if event:
+           t0 = time.perf_counter()
+           try:
+               outs = live.process(event)
+           except Exception as e:
+               # One bad event must not take the shard (and its conversations) down
+               errors += 1
+               outs = [dict(error_event(event, e), worker=idx)]
+           busy_s += time.perf_counter() - t0
+           for out in outs:
+               outbox.put(out)
+
+       now = time.perf_counter()
+       if now - last_sweep >= 5.0:
+           for out in live.evict_idle():
+               outbox.put(out)
+           last_sweep = now
+       if stats_interval_s and now - last_stats >= stats_interval_s:
+           outbox.put(stats(final=False))
+           last_stats = now
+
+   outbox.put(stats(final=True))
+   outbox.put({"type": "_done", "worker": idx})
+
+
+class WorkerDied(RuntimeError):
+   pass
+
+
+def _handle(out: Dict[str, Any], finished: set, summary: List[Dict[str, Any]]) -> None:
+   if out.get("type") == "_done":
+       finished.add(out["worker"])
+       return
+   if out.get("type") == "worker_stats" and out.get("final"):
+       summary.append(out)
+   emit(out)
+
+
+def _drain(
+   outbox: "mp.Queue",
+   procs: List[mp.Process],
+   summary: List[Dict[str, Any]],
+   failed: threading.Event,
+   failures: List[str],
+) -> None:
+   finished: set = set()
+   clean_exits: set = set()
+   while len(finished) < len(procs):
+       try:
+           _handle(outbox.get(timeout=1.0), finished, summary)
+           continue
+       except queue.Empty:
+           pass
+       exited = [i for i, p in enumerate(procs) if i not in finished and not p.is_alive()]
+       if not exited:
+           continue
+       # A worker may have put its _done marker and exited since the timed get:
+       # read whatever is already queued before judging it
+       while True:
+           try:
+               _handle(outbox.get_nowait(), finished, summary)
+           except queue.Empty:
+               break
+       unfinished = [i for i in exited if i not in finished]
+       # A clean exit gets one more cycle for its marker to arrive before it counts as lost
+       dead = [i for i in unfinished if procs[i].exitcode != 0 or i in clean_exits]
+       clean_exits.update(unfinished)
+       if dead:
+           failures.extend(
+               f"worker {i} (pid {procs[i].pid}) exited with code {procs[i].exitcode} before finishing" for i in dead
+           )
+           failed.set()
+           return
+
+
+def _put(inbox: "mp.Queue", item: Any, failed: threading.Event, failures: List[str]) -> None:
+   # A dead worker stops consuming, so a blocking put would hang once its queue fills
+   while True:
+       if failed.is_set():
+           raise WorkerDied("; ".join(failures))
+       try:
+           inbox.put(item, timeout=1.0)
+           return
+       except queue.Full:
+           continue
+
+
+def run_pool(
+   source: Callable[[], "queue.Queue[Optional[str]]"],
+   n_workers: int,
+   live_opts: Dict[str, Any],
+   normalize: bool = False,
+   stats_interval_s: float = 0.0,
+   queue_size: int = 1000,
+) -> List[Dict[str, Any]]:
+   """
+   Fork n_workers scorers over the already-loaded models, then start the source
+   (after forking, so no reader threads are copied into the workers) and feed them
+   until it ends. Returns the final per-worker stats.
+   """
+   if "emotion" not in _SHARED:
+       raise RuntimeError("Call load_shared_models() before run_pool().")
+   if "fork" not in mp.get_all_start_methods():
+       raise RuntimeError("Shared model memory needs the 'fork' start method (Linux/macOS).")
+
+   ctx = mp.get_context("fork")
+   threads = max(1, (os.cpu_count() or 1) // n_workers)
+   inboxes = [ctx.Queue(maxsize=queue_size) for _ in range(n_workers)]
+   outbox = ctx.Queue()
+   procs = [
+       ctx.Process(
+           target=_worker,
+           args=(i, inboxes[i], outbox, live_opts, normalize, threads, stats_interval_s),
+           daemon=True,
+       )
+       for i in range(n_workers)
+   ]
+   for p in procs:
+       p.start()
+
+   summary: List[Dict[str, Any]] = []
+   failed = threading.Event()
+   failures: List[str] = []
+   drainer = threading.Thread(target=_drain, args=(outbox, procs, summary, failed, failures), daemon=True)
+   drainer.start()
+
+   try:
+       lines = source()
+       while True:
+           try:
+               line = lines.get(timeout=1.0)
+           except queue.Empty:
+               line = ""
+           if line is None:
+               break
+           if failed.is_set():
+               raise WorkerDied("; ".join(failures))
+           event = parse_event(line) if line else None
+           if event is not None:
+               _put(inboxes[shard_for(str(event["conversation_id"]), n_workers)], event, failed, failures)
+
+       for inbox in inboxes:
+           _put(inbox, None, failed, failures)
+       drainer.join()
+       if failed.is_set():
+           raise WorkerDied("; ".join(failures))
+   except BaseException:
+       for p in procs:
+           if p.is_alive():
+               p.terminate()
+       raise
+   for p in procs:
+       p.join()
+   return sorted(summary, key=lambda s: s["worker"])
+
+
+def main() -> None:
+   ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+   add_live_args(ap)
+   ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+   args = ap.parse_args()
+
+   # The source starts after forking; check its paths before loading the models
+   try:
+       check_source(args)
+   except OSError as e:
+       ap.error(str(e))
+
+   load_shared_models()
+   try:
+       summary = run_pool(
+           lambda: start_source(args),
+           n_workers=max(1, args.workers),
+           live_opts=live_kwargs(args),
+           normalize=args.normalize,
+           stats_interval_s=args.stats_interval,
+       )
+   except WorkerDied as e:
+       print(f"worker pool failed: {e}", file=sys.stderr)
+       sys.exit(1)
+
+   total = sum(s["messages"] for s in summary)
+   for s in summary:
+       print(
+           f"worker {s['worker']} (pid {s['pid']}): {s['messages']} msgs ({s['errors']} errors), "
+           f"{s['msg_per_s']} msg/s busy, "
+           f"{s['utilization']:.0%} utilized",
+           file=sys.stderr,
+       )
+   print(f"total: {total} msgs across {len(summary)} workers", file=sys.stderr)
+
+
+if __name__ == "__main__":
+   main()